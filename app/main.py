@@ -1,10 +1,16 @@
+import asyncio
 import logging
 import os
 import re
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from itertools import zip_longest
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, NamedTuple, Optional
 
 import httpx
+import orjson
 from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
 
 try:
@@ -40,43 +46,90 @@ except (TypeError, ValueError) as exc:
     raise RuntimeError("Environment variable LOGS_CHAT_ID must be an integer.") from exc
 
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+_JSON_HEADERS = {"Content-Type": "application/json"}
 MARKDOWN_V2_SPECIAL_CHARS = r"_*[]()~`>#+-=|{}.!\\"
-_ESCAPE_PATTERN = re.compile(f"([{re.escape(MARKDOWN_V2_SPECIAL_CHARS)}])")
-_URL_ESCAPE_PATTERN = re.compile(r"([)\\])")
-_TOKEN_PATTERN = re.compile(
-    r"(?P<link>\[(?P<link_text>[^\]]+)\]\((?P<link_url>https?://[^\s)]+)\))"
-    r"|(?P<code>`(?P<code_text>[^`]+)`)"
-    r"|(?P<bold_italic>\*\*\*(?P<bold_italic_text>.+?)\*\*\*)"
-    r"|(?P<bold>\*\*(?P<bold_text>.+?)\*\*)"
-    r"|(?P<italic>(?<!\*)\*(?P<italic_text>[^*\n]+?)\*(?!\*))"
-    r"|(?P<url>https?://\S+)",
-    re.IGNORECASE,
+# Backslash goes first so the backslashes added for the other characters are not doubled.
+_ESCAPE_REPLACEMENTS = tuple(
+    (char, f"\\{char}") for char in "\\" + MARKDOWN_V2_SPECIAL_CHARS.replace("\\", "")
 )
-_TABLE_SEPARATOR_PATTERN = re.compile(r"^\s*\|?[\s:-]+\|[\s|:-]*$")
+_URL_ESCAPE_REPLACEMENTS = (("\\", "\\\\"), (")", "\\)"))
+_CODE_ESCAPE_REPLACEMENTS = (("\\", "\\\\"), ("`", "\\`"))
+_SPECIAL_CHAR_PATTERN = re.compile(f"[{re.escape(MARKDOWN_V2_SPECIAL_CHARS)}]")
+_INLINE_ANCHOR_PATTERN = re.compile(r"[\[`*]|://")
+_ASTRAL_CHAR_PATTERN = re.compile("[\U00010000-\U0010ffff]")
+_LINK_URL_PATTERN = re.compile(r"[Hh][Tt][Tt][Pp][Ss]?://[^\s)]+\)")
+_URL_PATTERN = re.compile(r"[Hh][Tt][Tt][Pp][Ss]?://\S+")
+_TABLE_SEPARATOR_PATTERN = re.compile(r"^(?:\s*\|)?[\s:-]+\|[\s|:-]*$")
 _LIST_ITEM_PATTERN = re.compile(r"^(?P<indent>[ \t]*)(?P<marker>[-*])\s+(?P<body>.*)$")
 _CHECKBOX_PATTERN = re.compile(r"^\[(?P<state>[ xX])\]\s+(?P<text>.*)$")
+_LIST_ITEM_STARTS = " \t-*"
+_LINE_PREFIX_STARTS = "#>"
+_LINE_PREFIX_TEMPLATES = {
+    "#": "__*_{}_*__",
+    "##": "__*{}*__",
+    "###": "__{}__",
+    ">": "> {}",
+}
 _LIST_MARKERS = ("\u2014", "\u00b7", "\u25b8", "\u25b9")
 _REFERENCE_LINK_PATTERN = re.compile(r"\[(\d+)\]\(([^)]+)\)")
 _INLINE_REFERENCE_PATTERN = re.compile(r"\[(\d+)\](?!\()")
+# Bound methods of the per-line/per-token patterns, looked up once at import.
+_special_char_search = _SPECIAL_CHAR_PATTERN.search
+_inline_anchor_search = _INLINE_ANCHOR_PATTERN.search
+_link_url_match = _LINK_URL_PATTERN.match
+_url_match = _URL_PATTERN.match
+_list_item_match = _LIST_ITEM_PATTERN.match
+_checkbox_match = _CHECKBOX_PATTERN.match
+_table_separator_match = _TABLE_SEPARATOR_PATTERN.match
+_ENTITY_MARKERS = {
+    "bold": ("**", "**"),
+    "italic": ("*", "*"),
+    "code": ("`", "`"),
+    "pre": ("```\n", "\n```"),
+}
+_FORMAT_CACHE_MAX_LENGTH = 4096
+_THREAD_OFFLOAD_MIN_LENGTH = 1024
+# Separators recognised by str.splitlines().
+_LINE_BREAKS = ("\n", "\r", "\v", "\f", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029")
 _LBRACK_TOKEN = "LBRACKTOKEN"
 _RBRACK_TOKEN = "RBRACKTOKEN"
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(application: FastAPI) -> AsyncIterator[None]:
+    """Keep one pooled HTTP/2 client for all Telegram API calls."""
+    timeout = httpx.Timeout(10, connect=3, pool=5)
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    async with httpx.AsyncClient(http2=True, timeout=timeout, limits=limits) as client:
+        application.state.http_client = client
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _escape_chars(text: str, replacements: tuple[tuple[str, str], ...]) -> str:
+    for char, escaped in replacements:
+        if char in text:
+            text = text.replace(char, escaped)
+    return text
 
 
 def escape_markdown_v2(text: str) -> str:
     """Escape characters that have special meaning in MarkdownV2."""
-    return _ESCAPE_PATTERN.sub(r"\\\1", text)
+    if not _special_char_search(text):
+        return text
+    return _escape_chars(text, _ESCAPE_REPLACEMENTS)
 
 
 def escape_markdown_v2_url(url: str) -> str:
     """Escape characters that have special meaning in MarkdownV2 URLs."""
-    return _URL_ESCAPE_PATTERN.sub(r"\\\1", url)
+    return _escape_chars(url, _URL_ESCAPE_REPLACEMENTS)
 
 
 def escape_markdown_v2_code(text: str) -> str:
     """Escape characters that have special meaning in MarkdownV2 code spans."""
-    return text.replace("\\", "\\\\").replace("`", "\\`")
+    return _escape_chars(text, _CODE_ESCAPE_REPLACEMENTS)
 
 
 def _extract_reference_links(lines: list[str]) -> tuple[list[str], dict[str, str]]:
@@ -125,14 +178,13 @@ def _replace_inline_references(text: str, ref_map: dict[str, str]) -> str:
     in_code_block = False
 
     for line in lines:
-        newline = ""
-        content = line
-        if line.endswith("\r\n"):
-            content = line[:-2]
-            newline = "\r\n"
-        elif line.endswith("\n") or line.endswith("\r"):
-            content = line[:-1]
-            newline = line[-1]
+        # splitlines() never yields empty lines, so the last character always exists.
+        if line[-2:] == "\r\n":
+            content, newline = line[:-2], "\r\n"
+        elif line[-1] in "\r\n":
+            content, newline = line[:-1], line[-1]
+        else:
+            content, newline = line, ""
 
         if content.strip().startswith("```"):
             in_code_block = not in_code_block
@@ -165,13 +217,13 @@ def _normalize_indent(indent: str) -> int:
 
 
 def _format_list_item(content: str) -> Optional[str]:
-    match = _LIST_ITEM_PATTERN.match(content)
+    match = _list_item_match(content)
     if not match:
         return None
 
     indent = match.group("indent")
     body = match.group("body")
-    checkbox_match = _CHECKBOX_PATTERN.match(body)
+    checkbox_match = _checkbox_match(body)
     checkbox = None
     if checkbox_match:
         checkbox = checkbox_match.group("state")
@@ -196,72 +248,114 @@ def _split_table_row(line: str) -> list[str]:
 
 
 def _format_table_block(lines: list[str]) -> list[str]:
-    rows: list[list[str]] = []
-    for line in lines:
-        rows.append(_split_table_row(line))
-
+    rows = [_split_table_row(line) for line in lines]
     if not rows:
         return []
 
-    col_count = max(len(row) for row in rows)
-    widths = [0] * col_count
-    for row in rows:
-        for idx in range(col_count):
-            cell = row[idx] if idx < len(row) else ""
-            widths[idx] = max(widths[idx], len(cell))
+    widths = [max(map(len, column)) for column in zip_longest(*rows, fillvalue="")]
 
     def render_row(row: list[str]) -> str:
-        padded = []
-        for idx in range(col_count):
-            cell = row[idx] if idx < len(row) else ""
-            padded.append(cell.ljust(widths[idx]))
-        return "| " + " | ".join(padded) + " |"
+        cells = " | ".join(cell.ljust(width) for cell, width in zip_longest(row, widths, fillvalue=""))
+        return f"| {cells} |"
 
     rendered = [render_row(rows[0])]
     rendered.append("| " + " | ".join("-" * width for width in widths) + " |")
-    for row in rows[1:]:
-        rendered.append(render_row(row))
+    rendered.extend(map(render_row, rows[1:]))
     return rendered
 
 
+def _format_link_token(text: str, start: int) -> Optional[tuple[str, int]]:
+    close = text.find("]", start + 1)
+    if close <= start + 1 or text[close + 1 : close + 2] != "(":
+        return None
+    match = _link_url_match(text, close + 2)
+    if not match:
+        return None
+    display = escape_markdown_v2(text[start + 1 : close])
+    url = text[close + 2 : match.end() - 1]
+    return f"[{display}]({escape_markdown_v2_url(url)})", match.end()
+
+
+def _format_code_token(text: str, start: int) -> Optional[tuple[str, int]]:
+    close = text.find("`", start + 1)
+    if close <= start + 1:
+        return None
+    inner = escape_markdown_v2_code(text[start + 1 : close])
+    return f"`{inner}`", close + 1
+
+
+def _format_emphasis_token(text: str, start: int) -> Optional[tuple[str, int]]:
+    if text.startswith("***", start):
+        close = text.find("***", start + 4)
+        if close != -1 and "\n" not in text[start + 3 : close]:
+            inner = escape_markdown_v2(text[start + 3 : close])
+            return f"*_{inner}_*", close + 3
+    if text.startswith("**", start):
+        close = text.find("**", start + 3)
+        if close != -1 and "\n" not in text[start + 2 : close]:
+            inner = escape_markdown_v2(text[start + 2 : close])
+            return f"*{inner}*", close + 2
+    if start and text[start - 1] == "*":
+        return None
+    close = text.find("*", start + 1)
+    if close <= start + 1 or text[close + 1 : close + 2] == "*":
+        return None
+    inner = text[start + 1 : close]
+    if "\n" in inner:
+        return None
+    return f"_{escape_markdown_v2(inner)}_", close + 1
+
+
+def _format_url_token(text: str, start: int) -> Optional[tuple[str, int]]:
+    match = _url_match(text, start)
+    if not match:
+        return None
+    url = match.group()
+    return f"[{escape_markdown_v2(url)}]({escape_markdown_v2_url(url)})", match.end()
+
+
+_INLINE_TOKEN_HANDLERS = {
+    "[": _format_link_token,
+    "`": _format_code_token,
+    "*": _format_emphasis_token,
+    "://": _format_url_token,
+}
+
+
+def _find_url_start(text: str, colon: int, position: int) -> int:
+    """Return where a bare URL whose scheme ends at colon starts, or -1."""
+    for start in (colon - 5, colon - 4):
+        if start >= position and _url_match(text, start):
+            return start
+    return -1
+
+
 def _format_inline(text: str) -> str:
     """Escape text and convert basic inline tokens (bold, links, bare URLs)."""
+    anchor = _inline_anchor_search(text)
+    if not anchor:
+        return escape_markdown_v2(text)
+
     result: list[str] = []
     last_index = 0
-
-    for match in _TOKEN_PATTERN.finditer(text):
-        start, end = match.span()
-        if start > last_index:
-            result.append(escape_markdown_v2(text[last_index:start]))
-
-        link_text = match.group("link_text")
-        link_url = match.group("link_url")
-        url = match.group("url")
-        bold_italic_text = match.group("bold_italic_text")
-        bold_text = match.group("bold_text")
-        italic_text = match.group("italic_text")
-        code_text = match.group("code_text")
-
-        if link_text and link_url:
-            display = escape_markdown_v2(link_text)
-            result.append(f"[{display}]({escape_markdown_v2_url(link_url)})")
-        elif code_text:
-            inner = escape_markdown_v2_code(code_text)
-            result.append(f"`{inner}`")
-        elif url:
-            display = escape_markdown_v2(url)
-            result.append(f"[{display}]({escape_markdown_v2_url(url)})")
-        elif bold_italic_text:
-            inner = escape_markdown_v2(bold_italic_text)
-            result.append(f"*_{inner}_*")
-        elif bold_text:
-            inner = escape_markdown_v2(bold_text)
-            result.append(f"*{inner}*")
-        elif italic_text:
-            inner = escape_markdown_v2(italic_text)
-            result.append(f"_{inner}_")
-
-        last_index = end
+    position = 0
+
+    while anchor:
+        start = anchor.start()
+        marker = anchor.group()
+        if marker == "://":
+            # Bare URLs are anchored on "://" and start at the preceding http/https.
+            start = _find_url_start(text, start, position)
+        token = _INLINE_TOKEN_HANDLERS[marker](text, start) if start >= 0 else None
+        if token is None:
+            position = anchor.start() + 1
+        else:
+            rendered, position = token
+            if start > last_index:
+                result.append(escape_markdown_v2(text[last_index:start]))
+            result.append(rendered)
+            last_index = position
+        anchor = _inline_anchor_search(text, position)
 
     if last_index < len(text):
         result.append(escape_markdown_v2(text[last_index:]))
@@ -270,88 +364,120 @@ def _format_inline(text: str) -> str:
 
 
 def _format_line(content: str) -> str:
-    stripped = content.strip()
-    if stripped == "---":
+    if "---" in content and content.strip() == "---":
         return r"\=\=\=\=\=\=\=\=\=\="
-    list_item = _format_list_item(content)
-    if list_item is not None:
-        return list_item
-    if content.startswith("# "):
-        inner = _format_inline(content[2:].lstrip())
-        return f"__*_{inner}_*__"
-    if content.startswith("## "):
-        inner = _format_inline(content[3:].lstrip())
-        return f"__*{inner}*__"
-    if content.startswith("### "):
-        inner = _format_inline(content[4:].lstrip())
-        return f"__{inner}__"
-    if content.startswith("> "):
-        inner = _format_inline(content[2:].lstrip())
-        return f"> {inner}"
+    first = content[:1]
+    if first and first in _LIST_ITEM_STARTS:
+        list_item = _format_list_item(content)
+        if list_item is not None:
+            return list_item
+    if first and first in _LINE_PREFIX_STARTS:
+        head, separator, body = content.partition(" ")
+        template = _LINE_PREFIX_TEMPLATES.get(head)
+        if template is not None and separator:
+            return template.format(_format_inline(body.lstrip()))
     return _format_inline(content)
 
 
-def format_for_markdown_v2(text: str) -> str:
-    """
-    Prepare text for Telegram MarkdownV2:
-    - escape special characters
-    - make bare URLs clickable
-    - support **bold** (converted to Telegram *bold*)
-    - keep line breaks intact
-    """
-    lines = text.splitlines(keepends=True)
-    formatted_lines: list[str] = []
+def _restore_reference_brackets(line: str) -> str:
+    return line.replace(_LBRACK_TOKEN, r"\[").replace(_RBRACK_TOKEN, r"\]")
+
+
+def _iter_formatted_lines(text: str) -> Iterator[str]:
+    """Yield formatted MarkdownV2 lines, each ending with a "\n" line break."""
+    lines = text.splitlines()
+    line_count = len(lines)
+    last_newline = "\n" if text.endswith(_LINE_BREAKS) else ""
     in_code_block = False
     index = 0
 
-    while index < len(lines):
-        line = lines[index]
-        newline = ""
-        content = line
-        if line.endswith("\r\n"):
-            content = line[:-2]
-            newline = "\r\n"
-        elif line.endswith("\n") or line.endswith("\r"):
-            content = line[:-1]
-            newline = line[-1]
+    while index < line_count:
+        content = lines[index]
+        newline = "\n" if index + 1 < line_count else last_newline
 
         if content.strip().startswith("```"):
             in_code_block = not in_code_block
-            formatted_lines.append(f"{content}{newline}")
+            yield _restore_reference_brackets(f"{content}{newline}")
             index += 1
             continue
 
         if in_code_block:
-            formatted_lines.append(f"{escape_markdown_v2_code(content)}{newline}")
+            yield _restore_reference_brackets(f"{escape_markdown_v2_code(content)}{newline}")
             index += 1
             continue
 
-        if "|" in content and index + 1 < len(lines):
-            next_line = lines[index + 1]
-            next_content = next_line.rstrip("\r\n")
-            if "|" in next_content and _TABLE_SEPARATOR_PATTERN.match(next_content):
+        if "|" in content and index + 1 < line_count:
+            next_content = lines[index + 1]
+            if "|" in next_content and _table_separator_match(next_content):
                 table_lines = [content]
                 index += 2
-                while index < len(lines):
-                    candidate = lines[index].rstrip("\r\n")
+                while index < line_count:
+                    candidate = lines[index]
                     if "|" not in candidate:
                         break
                     table_lines.append(candidate)
                     index += 1
                 rendered = _format_table_block(table_lines)
-                formatted_lines.append("```\n")
+                yield "```\n"
                 for rendered_line in rendered:
-                    formatted_lines.append(f"{escape_markdown_v2_code(rendered_line)}\n")
-                formatted_lines.append(f"```{newline}")
+                    yield _restore_reference_brackets(f"{escape_markdown_v2_code(rendered_line)}\n")
+                yield "```\n"
                 continue
 
-        formatted_lines.append(f"{_format_line(content)}{newline}")
+        yield _restore_reference_brackets(f"{_format_line(content)}{newline}")
         index += 1
 
-    rendered = "".join(formatted_lines)
-    rendered = rendered.replace(_LBRACK_TOKEN, r"\[")
-    rendered = rendered.replace(_RBRACK_TOKEN, r"\]")
-    return rendered
+
+@lru_cache(maxsize=128)
+def _format_cached(text: str) -> str:
+    return "".join(_iter_formatted_lines(text))
+
+
+def format_for_markdown_v2(text: str) -> str:
+    """
+    Prepare text for Telegram MarkdownV2:
+    - escape special characters
+    - make bare URLs clickable
+    - support **bold** (converted to Telegram *bold*)
+    - keep line breaks intact
+    """
+    # Long one-off posts would only evict the short, repeated texts worth caching.
+    if len(text) > _FORMAT_CACHE_MAX_LENGTH:
+        return "".join(_iter_formatted_lines(text))
+    return _format_cached(text)
+
+
+def split_message(text: str, limit: int = 4096) -> list[str]:
+    """Split text into Telegram-sized chunks, preferring line boundaries."""
+    chunks: list[str] = []
+    text_len = len(text)
+    chunk_start = 0
+
+    while text_len - chunk_start > limit:
+        # The last newline inside the window closes the longest run of whole lines that fits.
+        chunk_end = text.rfind("\n", chunk_start, chunk_start + limit) + 1
+        if chunk_end:
+            chunks.append(text[chunk_start:chunk_end])
+        else:
+            chunk_end = text.find("\n", chunk_start) + 1 or text_len
+            for start in range(chunk_start, chunk_end, limit):
+                chunks.append(text[start : min(start + limit, chunk_end)])
+        chunk_start = chunk_end
+
+    if chunk_start < text_len:
+        chunks.append(text[chunk_start:])
+
+    return chunks
+
+
+def format_and_split(text: str, limit: int = 4096) -> list[str]:
+    """Format text for MarkdownV2 and split it into Telegram-sized chunks."""
+    formatted = format_for_markdown_v2(text)
+    if len(formatted) <= limit:
+        return [formatted] if formatted else []
+    # Formatted lines always end in "\n", so splitting the joined text on
+    # newlines cuts at the same line boundaries as packing the lines would.
+    return split_message(formatted, limit)
 
 
 def is_command(text: str, command: str) -> bool:
@@ -394,30 +520,37 @@ def build_help_text() -> str:
     )
 
 
+_HELP_CHUNKS = format_and_split(build_help_text())
+
+
 async def send_chunks(chat_id: int, chunks: list[str], parse_mode: Optional[str] = "MarkdownV2") -> None:
-    async with httpx.AsyncClient(timeout=10) as client:
-        for chunk in chunks:
-            payload = {
-                "chat_id": chat_id,
-                "text": chunk,
-            }
-            if parse_mode:
-                payload["parse_mode"] = parse_mode
-
-            try:
-                response = await client.post(TELEGRAM_API_URL, json=payload)
-                response.raise_for_status()
-            except httpx.HTTPStatusError as exc:
-                logging.error(
-                    "Telegram API error: chat_id=%s status=%s body=%s",
-                    chat_id,
-                    exc.response.status_code,
-                    exc.response.text,
-                )
-                break
-            except httpx.HTTPError as exc:
-                logging.exception("Failed to send message to Telegram: %s", exc)
-                break
+    client: httpx.AsyncClient = app.state.http_client
+    for chunk in chunks:
+        payload = {
+            "chat_id": chat_id,
+            "text": chunk,
+        }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+
+        try:
+            response = await client.post(
+                TELEGRAM_API_URL,
+                content=orjson.dumps(payload),
+                headers=_JSON_HEADERS,
+            )
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            logging.error(
+                "Telegram API error: chat_id=%s status=%s body=%s",
+                chat_id,
+                exc.response.status_code,
+                exc.response.text,
+            )
+            break
+        except httpx.HTTPError as exc:
+            logging.exception("Failed to send message to Telegram: %s", exc)
+            break
 
 
 def format_sender(sender: Dict[str, Any], chat_id: int) -> str:
@@ -451,53 +584,87 @@ def format_log_header(kind: str, sender: Dict[str, Any], chat_id: int) -> str:
     return header
 
 
-def _utf16_offset_to_index(text: str, offset: int) -> int:
-    count = 0
-    for index, ch in enumerate(text):
-        if count >= offset:
-            return index
-        count += 2 if ord(ch) > 0xFFFF else 1
-    return len(text)
+def _utf16_offsets_to_indices(text: str, offsets: list[int]) -> dict[int, int]:
+    """Map UTF-16 code unit offsets to string indices."""
+    # Code unit offset at which each non-BMP character (a surrogate pair) starts.
+    astral_units = [
+        match.start() + count for count, match in enumerate(_ASTRAL_CHAR_PATTERN.finditer(text))
+    ]
+    text_len = len(text)
+    indices: dict[int, int] = {}
+    for offset in offsets:
+        pairs_before = bisect_left(astral_units, offset)
+        index = offset - pairs_before
+        if pairs_before and astral_units[pairs_before - 1] + 1 == offset:
+            # Offset points inside a surrogate pair; round up past the character.
+            index += 1
+        indices[offset] = min(max(index, 0), text_len)
+    return indices
 
 
 def apply_entities(text: str, entities: Optional[list[Dict[str, Any]]]) -> str:
     if not entities:
         return text
 
-    inserts: list[tuple[int, str]] = []
+    spans: list[tuple[str, int, int]] = []
     for entity in entities:
         entity_type = entity.get("type")
-        if entity_type not in {"bold", "italic", "code", "pre"}:
+        if entity_type not in _ENTITY_MARKERS:
             continue
         offset = entity.get("offset")
         length = entity.get("length")
         if not isinstance(offset, int) or not isinstance(length, int):
             continue
-        start = _utf16_offset_to_index(text, offset)
-        end = _utf16_offset_to_index(text, offset + length)
-        if entity_type == "bold":
-            marker = "**"
-            inserts.append((end, marker))
-            inserts.append((start, marker))
-        elif entity_type == "italic":
-            marker = "*"
-            inserts.append((end, marker))
-            inserts.append((start, marker))
-        elif entity_type == "code":
-            inserts.append((end, "`"))
-            inserts.append((start, "`"))
-        elif entity_type == "pre":
-            inserts.append((end, "\n```"))
-            inserts.append((start, "```\n"))
-
-    if not inserts:
+        spans.append((entity_type, offset, offset + length))
+
+    if not spans:
         return text
 
-    inserts.sort(key=lambda item: (item[0], len(item[1])), reverse=True)
-    result = text
-    for position, marker in inserts:
-        result = result[:position] + marker + result[position:]
-    return result
+    indices = _utf16_offsets_to_indices(text, [offset for span in spans for offset in span[1:]])
+    # At the same position, shorter markers come first; among equal lengths,
+    # markers appended later come first.
+    inserts: list[tuple[int, int, int, str]] = []
+    for entity_type, start, end in spans:
+        open_marker, close_marker = _ENTITY_MARKERS[entity_type]
+        inserts.append((indices[end], len(close_marker), -len(inserts), close_marker))
+        inserts.append((indices[start], len(open_marker), -len(inserts), open_marker))
+
+    inserts.sort()
+    parts: list[str] = []
+    cursor = 0
+    for position, _, _, marker in inserts:
+        parts.append(text[cursor:position])
+        parts.append(marker)
+        cursor = position
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def prepare_incoming_text(text: str, entities: Optional[list[Dict[str, Any]]]) -> str:
+    """Turn Telegram entities and trailing reference links back into Markdown."""
+    return apply_reference_links(apply_entities(text, entities))
+
+
+async def send_log_entry(
+    chat_id: int,
+    sender: Dict[str, Any],
+    raw_text: Optional[str],
+    chunks: list[str],
+) -> None:
+    # Log headers are a single short line, so they never need splitting, and the
+    # OUT copy reuses the chunks already sent to the user.
+    await send_chunks(LOGS_CHAT_ID_INT, [format_log_header("IN", sender, chat_id)])
+    if raw_text:
+        await send_chunks(LOGS_CHAT_ID_INT, split_message(raw_text), parse_mode=None)
+    await send_chunks(LOGS_CHAT_ID_INT, [format_log_header("OUT", sender, chat_id)])
+    await send_chunks(LOGS_CHAT_ID_INT, chunks)
+
+
+async def send_help(chat_id: int) -> None:
+    if DRY_RUN:
+        logging.info("DRY_RUN enabled. chat_id=%s help_text=%s", chat_id, "".join(_HELP_CHUNKS))
+        return
+    await send_chunks(chat_id, _HELP_CHUNKS)
 
 
 async def handle_message(
@@ -505,104 +672,76 @@ async def handle_message(
     sender: Dict[str, Any],
     text: str,
     raw_text: Optional[str],
-    *,
-    log_entry: bool = True,
 ) -> None:
-    formatted = format_for_markdown_v2(text)
-    chunks = split_message(formatted)
+    if len(text) > _THREAD_OFFLOAD_MIN_LENGTH:
+        # Long texts would hold the event loop for milliseconds; format them in a worker thread.
+        chunks = await asyncio.to_thread(format_and_split, text)
+    else:
+        chunks = format_and_split(text)
 
     if DRY_RUN:
         logging.info(
             "DRY_RUN enabled. chat_id=%s logs_chat_id=%s formatted_text=%s",
             chat_id,
             LOGS_CHAT_ID_INT,
-            formatted,
+            "".join(chunks),
         )
         return
 
-    if log_entry:
-        header = format_log_header("IN", sender, chat_id)
-        await send_chunks(LOGS_CHAT_ID_INT, split_message(header))
-        if raw_text:
-            await send_chunks(LOGS_CHAT_ID_INT, split_message(raw_text), parse_mode=None)
-    await send_chunks(chat_id, chunks)
-    if log_entry:
-        log_out = format_log_header("OUT", sender, chat_id)
-        await send_chunks(LOGS_CHAT_ID_INT, split_message(log_out))
-        await send_chunks(LOGS_CHAT_ID_INT, chunks)
+    # Telegram keeps per-chat order only for sequential sends, so the user reply
+    # and the log transcript run concurrently while each stays ordered.
+    await asyncio.gather(
+        send_chunks(chat_id, chunks),
+        send_log_entry(chat_id, sender, raw_text, chunks),
+    )
+
+
+class IncomingMessage(NamedTuple):
+    chat_id: Optional[int]
+    chat_type: Optional[str]
+    sender: Dict[str, Any]
+    text: Optional[str]
+    entities: Optional[list[Dict[str, Any]]]
 
 
-def extract_message(update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    """Get the message object from common Telegram update payloads."""
+def extract_incoming_message(update: Dict[str, Any]) -> Optional[IncomingMessage]:
+    """Read chat, sender, text and entities from a Telegram update in one pass."""
     for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
         message = update.get(key)
         if message:
-            return message
-    return None
-
+            break
+    else:
+        return None
 
-def extract_text_and_entities(
-    message: Dict[str, Any],
-) -> tuple[Optional[str], Optional[list[Dict[str, Any]]]]:
-    """Extract text/caption and entities from a Telegram message."""
     if "text" in message:
-        return str(message["text"]), message.get("entities")
-    if "caption" in message:
-        return str(message["caption"]), message.get("caption_entities")
-    return None, None
-
+        text, entities = str(message["text"]), message.get("entities")
+    elif "caption" in message:
+        text, entities = str(message["caption"]), message.get("caption_entities")
+    else:
+        text, entities = None, None
 
-def extract_chat_info(message: Dict[str, Any]) -> tuple[Optional[int], Optional[str]]:
-    """Get chat_id and chat_type from a Telegram message."""
     chat = message.get("chat") or {}
-    chat_id = chat.get("id")
     chat_type = chat.get("type")
-    if chat_id is not None:
-        try:
-            return int(chat_id), str(chat_type) if chat_type is not None else None
-        except (TypeError, ValueError):
-            return None, str(chat_type) if chat_type is not None else None
-    return None, str(chat_type) if chat_type is not None else None
-
+    if chat_type is not None:
+        chat_type = str(chat_type)
+    try:
+        chat_id = int(chat["id"])
+    except (KeyError, TypeError, ValueError):
+        chat_id = None
 
-def extract_sender(message: Dict[str, Any]) -> Dict[str, Any]:
-    """Get sender details from a Telegram message."""
     sender = message.get("from") or {}
-    return {
-        "id": sender.get("id"),
-        "username": sender.get("username"),
-        "first_name": sender.get("first_name"),
-        "last_name": sender.get("last_name"),
-    }
-
-
-def split_message(text: str, limit: int = 4096) -> list[str]:
-    """Split text into Telegram-sized chunks, preferring line boundaries."""
-    chunks: list[str] = []
-    current = ""
-
-    for line in text.splitlines(keepends=True):
-        if len(current) + len(line) <= limit:
-            current += line
-            continue
-
-        if current:
-            chunks.append(current)
-            current = ""
-
-        if len(line) <= limit:
-            current = line
-        else:
-            start = 0
-            while start < len(line):
-                end = min(start + limit, len(line))
-                chunks.append(line[start:end])
-                start = end
-
-    if current:
-        chunks.append(current)
-
-    return chunks
+    return IncomingMessage(
+        chat_id=chat_id,
+        chat_type=chat_type,
+        sender={
+            "id": sender.get("id"),
+            "username": sender.get("username"),
+            "first_name": sender.get("first_name"),
+            "last_name": sender.get("last_name"),
+        },
+        text=text,
+        entities=entities,
+    )
 
 
 @app.get("/healthz")
@@ -616,25 +755,21 @@ async def telegram_webhook(request: Request, background_tasks: BackgroundTasks)
     if secret_header != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    update = await request.json()
-    message = extract_message(update)
-    if not message:
+    update = orjson.loads(await request.body())
+    incoming = extract_incoming_message(update)
+    if incoming is None or incoming.chat_type != "private":
         return {"ok": True}
 
-    text, entities = extract_text_and_entities(message)
-    chat_id, chat_type = extract_chat_info(message)
-    sender = extract_sender(message)
-
-    if chat_type != "private":
-        return {"ok": True}
+    chat_id, _, sender, text, entities = incoming
 
     if text and chat_id is not None:
         raw_text = text
-        text = apply_entities(text, entities)
-        text = apply_reference_links(text)
+        if len(text) > _THREAD_OFFLOAD_MIN_LENGTH:
+            text = await asyncio.to_thread(prepare_incoming_text, text, entities)
+        else:
+            text = prepare_incoming_text(text, entities)
         if is_command(text, "/start") or is_command(text, "/help"):
-            help_text = build_help_text()
-            background_tasks.add_task(handle_message, chat_id, sender, help_text, None, log_entry=False)
+            background_tasks.add_task(send_help, chat_id)
         else:
             background_tasks.add_task(handle_message, chat_id, sender, text, raw_text)
 